@@ -1,6 +1,18 @@
-from pirc522 import RFID
+from RFIDReader import RFIDContext
 
-rdr = RFID()
+# Default authentication key
+DEFAULT_KEY = [0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF]
+
+# New custom key (change these values)
+NEW_KEY = [0xA1, 0xB2, 0xC3, 0xD4, 0xE5, 0xF6]
+
+# Access bits (define permissions)
+ACCESS_BITS = [0xFF, 0x07, 0x80, 0x69]  # Example access control settings
+
+# Sector trailer block (new key + access bits + Key B)
+SECTOR_TRAILER = NEW_KEY + ACCESS_BITS + NEW_KEY
+
+rdr = RFIDContext.get()
 rdr.wait_for_tag()
 (error, tag_type) = rdr.request()
 if not error:
@@ -8,22 +20,10 @@ if not error:
     if not error:
         print("Tag detected! UID:", uid)
         rdr.select_tag(uid)
-        
-        # Default authentication key
-        default_key = [0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF]
-        rdr.auth(rdr.AUTHENT1A, 7, default_key, uid)  # Authenticate sector trailer
-        
-        # New custom key (change these values)
-        new_key = [0xA1, 0xB2, 0xC3, 0xD4, 0xE5, 0xF6]
-        
-        # Access bits (define permissions)
-        access_bits = [0xFF, 0x07, 0x80, 0x69]  # Example access control settings
-        
-        # Construct sector trailer block (new key + access bits + Key B)
-        sector_trailer = new_key + access_bits + new_key
-        
+        rdr.auth(rdr.AUTHENT1A, 7, DEFAULT_KEY, uid)  # Authenticate sector trailer
+
         # Write new key to sector trailer
-        rdr.write(7, sector_trailer)
+        rdr.write(7, SECTOR_TRAILER)
         rdr.stop_crypto()
         
         print("Custom key set successfully!")
@@ -44,4 +44,4 @@ if not error:
 # Using the Custom Key
 
 # Once set, you must use the new key for authentication:
-# rdr.auth(rdr.AUTHENT1A, 8, new_key, uid)
+# rdr.auth(rdr.AUTHENT1A, 8, NEW_KEY, uid)
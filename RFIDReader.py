@@ -0,0 +1,48 @@
+import atexit
+import logging
+import threading
+from pirc522 import RFID
+
+log = logging.getLogger(__name__)
+
+
+class RFIDContext:
+    """
+    Hands out one shared RFID() instance per process.
+    The MFRC522 is only initialised over SPI the first time a reader is requested,
+    and is cleaned up automatically at interpreter exit.
+    Keyword arguments are passed to RFID() on first use; later calls must pass
+    the same ones, or ValueError is raised.
+
+    Usage:
+        rdr = RFIDContext.get()
+    """
+    _lock = threading.Lock()
+    _reader = None
+    _kwargs = None
+
+    @classmethod
+    def get(cls, **kwargs):
+        with cls._lock:
+            if cls._reader is None:
+                cls._reader = RFID(**kwargs)
+                cls._kwargs = kwargs
+                atexit.register(cls.cleanup)
+            elif kwargs != cls._kwargs:
+                raise ValueError(
+                    f"RFID reader already created with {cls._kwargs}, requested with {kwargs}")
+            return cls._reader
+
+    @classmethod
+    def cleanup(cls):
+        with cls._lock:
+            if cls._reader is None:
+                return
+            try:
+                cls._reader.cleanup()
+                log.info("RFID reader cleanup completed.")
+            except Exception as cleanup_err:
+                log.error("Error during RFID cleanup: %s", cleanup_err)
+            finally:
+                cls._reader = None
+                cls._kwargs = None
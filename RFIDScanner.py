@@ -0,0 +1,480 @@
+import asyncio
+import atexit
+import collections
+import logging
+import logging.handlers
+import os
+import queue
+import select
+import sys
+import threading
+import time
+from enum import IntEnum
+from typing import Optional, Protocol
+from RFIDReader import RFIDContext
+
+log = logging.getLogger(__name__)
+
+# MFRC522 IRQ line, BCM numbering: physical pin 18, pirc522's default.
+RFID_IRQ_BCM = 24
+# sysfs numbers the pin from its gpiochip's base, which is 512 on kernels 6.6+ and
+# 0 on older ones, so the number is looked up at startup. Set to override the lookup.
+RFID_IRQ_SYSFS = None
+SYSFS_GPIO = "/sys/class/gpio"
+# How long to wait for a tag to answer before re-sending the REQA command.
+IRQ_REARM_INTERVAL = 0.1
+
+# A UID is ignored until it has gone unseen for this many seconds.
+DUPLICATE_SCAN_TTL = 2.0
+
+# Reused for every UID conversion: 4 UID bytes + BCC, as returned by anticoll().
+_UID_BUF = bytearray(5)
+
+# Marker written to block 8 of every enrolled tag, padded to the 16-byte block size.
+REGISTERED_PAYLOAD = list(b"Registered".ljust(16, b"\x00"))
+
+
+class Mode(IntEnum):
+    """Operational mode: READ for access checking, WRITE for enrolling new tags."""
+    READ = 0
+    WRITE = 1
+
+
+# Global mode variable, switched by command_listener.
+current_mode = Mode.READ
+
+
+# --------------------------------------------------
+# 1. Logging Configuration
+# --------------------------------------------------
+def setup_logging(filename):
+    """
+    Sends all records from the root logger to filename and the console.
+    Records are handed to a background thread through a queue, so file and console
+    I/O never stalls the event loop. File writes are buffered until 64 records have
+    accumulated or a WARNING (or worse) arrives. Call once, before anything else
+    registers an exit hook.
+    """
+    log_formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+    file_handler = logging.FileHandler(filename, delay=True)
+    file_handler.setFormatter(log_formatter)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(log_formatter)
+    log_queue = queue.Queue(-1)
+    log_listener = logging.handlers.QueueListener(
+        log_queue,
+        logging.handlers.MemoryHandler(capacity=64, flushLevel=logging.WARNING, target=file_handler),
+        stream_handler
+    )
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    log_listener.start()
+    # Registered before any other exit hook so it stops last and drains their records.
+    atexit.register(log_listener.stop)
+
+
+# --------------------------------------------------
+# 2. Storage Backend Interface
+# --------------------------------------------------
+class Backend(Protocol):
+    """
+    Where registered tags live. scan_rfid only talks to storage through these
+    two methods, so the same scan loop serves the SQLite system and the
+    in-memory test script.
+    """
+
+    async def lookup(self, uid: str) -> Optional[str]:
+        """Returns the label registered for uid, or None."""
+
+    async def insert(self, uid: str, label: str) -> None:
+        """Registers uid with label."""
+
+
+# --------------------------------------------------
+# 3. Retry Mechanism for RFID Operations
+# --------------------------------------------------
+async def perform_rfid_operation(operation, *args, max_retries=3, base_delay=0.5, **kwargs):
+    """
+    Calls a synchronous operation that might fail, retrying with exponential backoff.
+    The first attempt runs straight through; the retry loop is only entered on failure.
+    """
+    try:
+        return operation(*args, **kwargs)
+    except Exception as ex:
+        error = ex
+    for retries in range(1, max_retries + 1):
+        delay = base_delay * (2 ** (retries - 1))
+        log.warning("Operation %s failed with error: %s. Retrying in %.2f sec (attempt %d of %d)",
+                    operation.__name__, error, delay, retries, max_retries)
+        await asyncio.sleep(delay)
+        try:
+            return operation(*args, **kwargs)
+        except Exception as ex:
+            error = ex
+    log.error("Operation %s failed after %d retries: %s", operation.__name__, max_retries, error)
+    raise error
+
+
+# --------------------------------------------------
+# 4. RFID Polling, Using Nonblocking Asyncio and Retry
+# --------------------------------------------------
+def _sysfs_write(path, value):
+    with open(path, "w") as f:
+        f.write(str(value))
+
+
+def sysfs_gpio_number(bcm):
+    """
+    Returns the sysfs number of a BCM GPIO: the base of the SoC's pinctrl
+    gpiochip plus the BCM offset. Falls back to the lowest chip base if no
+    chip is labelled as the BCM pinctrl.
+    """
+    bases = {}
+    for entry in os.listdir(SYSFS_GPIO):
+        if not entry.startswith("gpiochip"):
+            continue
+        with open(f"{SYSFS_GPIO}/{entry}/label") as f:
+            label = f.read().strip()
+        with open(f"{SYSFS_GPIO}/{entry}/base") as f:
+            bases[label] = int(f.read())
+    if not bases:
+        raise RuntimeError(f"No gpiochip found under {SYSFS_GPIO}")
+    pinctrl = [base for label, base in bases.items() if label.startswith("pinctrl-bcm")]
+    return min(pinctrl or bases.values()) + bcm
+
+
+def attach_tag_irq(loop, event):
+    """
+    Wires the MFRC522 IRQ pin to an asyncio.Event through the sysfs GPIO interface,
+    so edges are handled on the event loop itself rather than a GPIO callback thread.
+    sysfs signals an edge with POLLPRI, which add_reader cannot wait for, so the
+    value fd sits in its own epoll set and the loop watches that epoll fd instead.
+    Returns (clear, detach): clear() drops any edge already seen and resets the
+    event; detach() removes the reader, closes the file descriptors and unexports
+    the pin.
+    """
+    gpio = RFID_IRQ_SYSFS if RFID_IRQ_SYSFS is not None else sysfs_gpio_number(RFID_IRQ_BCM)
+    gpio_path = f"{SYSFS_GPIO}/gpio{gpio}"
+    if not os.path.exists(gpio_path):
+        _sysfs_write(f"{SYSFS_GPIO}/export", gpio)
+    _sysfs_write(f"{gpio_path}/direction", "in")
+    _sysfs_write(f"{gpio_path}/edge", "falling")
+    value_fd = os.open(f"{gpio_path}/value", os.O_RDONLY | os.O_NONBLOCK)
+    os.read(value_fd, 8)  # Consume the current level so only new edges are reported.
+    irq_poll = select.epoll()
+    irq_poll.register(value_fd, select.EPOLLPRI | select.EPOLLET)
+
+    def drain():
+        if not irq_poll.poll(0):
+            return False
+        os.lseek(value_fd, 0, os.SEEK_SET)
+        os.read(value_fd, 8)
+        return True
+
+    def on_irq():
+        # Re-checks the epoll set, so a call still queued after clear() is a no-op.
+        if drain():
+            event.set()
+
+    def clear():
+        drain()
+        event.clear()
+
+    loop.add_reader(irq_poll.fileno(), on_irq)
+
+    def detach():
+        loop.remove_reader(irq_poll.fileno())
+        irq_poll.close()
+        os.close(value_fd)
+        _sysfs_write(f"{SYSFS_GPIO}/unexport", gpio)
+
+    return clear, detach
+
+
+def arm_tag_irq(rdr, clear_irq):
+    """
+    Sends a REQA and enables the receive interrupt, so the IRQ pin fires
+    as soon as a tag answers. Same register sequence as pirc522's wait_for_tag().
+    Earlier transceives (poll_for_tag, auth, write) also pull the IRQ pin low, so
+    clear_irq() discards those edges once the chip is reset and before the REQA
+    goes out; clearing after sending could swallow the tag's own answer.
+    """
+    rdr.init()
+    rdr.dev_write(0x04, 0x00)  # ComIrqReg: clear pending interrupts
+    rdr.dev_write(0x02, 0xA0)  # ComIEnReg: IRQ on receive, inverted pin
+    rdr.dev_write(0x03, 0x80)  # DivIEnReg: push-pull IRQ pin
+    clear_irq()
+    rdr.dev_write(0x09, 0x26)  # FIFODataReg: REQA
+    rdr.dev_write(0x01, 0x0C)  # CommandReg: Transceive
+    rdr.dev_write(0x0D, 0x87)  # BitFramingReg: StartSend, 7 bits
+
+
+def poll_for_tag(rdr):
+    """
+    Polls for a tag using low-level RFID library calls.
+    If an error code is returned instead of a tag, an Exception is raised.
+    Each of request() and anticoll() is a transceive that must wait for the chip
+    to finish before its FIFO can be read, so they cannot share one SPI transfer.
+    """
+    error, tag_type = rdr.request()
+    if error:
+        raise Exception(f"RFID request error: {error}")
+    error_uid, raw_uid = rdr.anticoll()
+    if error_uid:
+        raise Exception(f"RFID anticoll error: {error_uid}")
+    return raw_uid
+
+
+def format_uid(raw_uid):
+    """
+    Returns the hex key for a raw UID, converting through a reused buffer
+    instead of allocating a new bytes object per scan. Event-loop thread only.
+    """
+    _UID_BUF[:] = raw_uid
+    return _UID_BUF.hex()
+
+
+async def enrollment_worker(rdr, reader_lock, console, backend: Backend, enroll_queue, awaiting):
+    """
+    Enrolls tags queued by scan_rfid, one at a time.
+    Prompting for a label happens here so the scanning task never waits on the user.
+    The poll/auth/write sequence holds reader_lock, so the scan loop cannot reset
+    the chip while a retry backoff yields to the event loop.
+    """
+    log.info("Starting enrollment worker task.")
+    try:
+        while True:
+            raw_uid, uid_key = await enroll_queue.get()
+            try:
+                label = await console.readline("Enter a label for the new tag: ", urgent=True)
+                label = label.strip()
+                if not label:
+                    log.warning("Empty label input. Skipping enrollment for UID: %s", uid_key)
+                    continue
+
+                async with reader_lock:
+                    # Scanning kept running while the user typed; make sure the tag is still there.
+                    # The scan loop leaves the tag READY after its REQA, so reset the chip first.
+                    rdr.init()
+                    current_uid = await perform_rfid_operation(poll_for_tag, rdr)
+                    if format_uid(current_uid) != uid_key:
+                        log.warning("Tag %s was removed before enrollment. Skipping.", uid_key)
+                        continue
+
+                    # Perform the authentication and writing with retries.
+                    await perform_rfid_operation(rdr.auth, rdr.AUTHENT1A, 8, [0xFF] * 6, raw_uid)
+                    await perform_rfid_operation(rdr.write, 8, REGISTERED_PAYLOAD)
+                    # Stop encryption; wrap in try/except since it’s final.
+                    try:
+                        rdr.stop_crypto()
+                    except Exception as ex:
+                        log.warning("Error during stop_crypto: %s", ex)
+                log.info("Data written to tag (block 8).")
+
+                # The backend logs the enrollment once it is actually stored.
+                await backend.insert(uid_key, label)
+            except Exception as enroll_ex:
+                log.error("Error in enrollment process: %s", enroll_ex)
+            finally:
+                awaiting.discard(uid_key)
+                enroll_queue.task_done()
+    except asyncio.CancelledError:
+        log.info("Enrollment worker task canceled.")
+        raise
+
+
+async def handle_read(uid_key, raw_uid, backend: Backend, enroll_queue, awaiting):
+    """
+    Allow/Deny Mode: Check registration against the backend.
+    """
+    try:
+        label = await backend.lookup(uid_key)
+    except Exception as db_ex:
+        log.error("Database error during access check: %s", db_ex)
+        return
+    if label is not None:
+        log.info("Access Allowed! Registered label: %s", label)
+    else:
+        log.info("Access Denied! Tag not registered.")
+
+
+async def handle_write(uid_key, raw_uid, backend: Backend, enroll_queue, awaiting):
+    """
+    Enroll Mode: Hand new tags to the enrollment worker.
+    """
+    if await backend.lookup(uid_key) is not None:
+        log.info("Tag already registered. Enrollment denied.")
+    elif uid_key in awaiting:
+        log.info("Tag already queued for enrollment.")
+    else:
+        awaiting.add(uid_key)
+        enroll_queue.put_nowait((raw_uid, uid_key))
+        log.info("Tag queued for enrollment.")
+
+
+MODE_HANDLERS = {
+    Mode.READ: handle_read,
+    Mode.WRITE: handle_write,
+}
+
+
+async def scan_rfid(console, backend: Backend):
+    """
+    Waits for the reader IRQ without blocking the event loop, then reads the tag.
+    Each unique tag is dispatched to the MODE_HANDLERS entry for current_mode.
+    Registered tags are looked up through backend; unknown tags seen in
+    enroll mode are handed to enrollment_worker so scanning keeps going.
+    Wrapped operations are retried if transient errors occur.
+    """
+    rdr = RFIDContext.get(pin_irq=None)
+    tag_irq = asyncio.Event()
+    clear_irq, detach_irq = attach_tag_irq(asyncio.get_running_loop(), tag_irq)
+    reader_lock = asyncio.Lock()  # Serializes MFRC522 access with enrollment_worker.
+    enroll_queue = asyncio.Queue()
+    awaiting = set()  # UIDs queued for enrollment but not yet processed.
+    worker = asyncio.create_task(enrollment_worker(rdr, reader_lock, console, backend, enroll_queue, awaiting))
+    log.info("Starting RFID scanning task.")
+    recent = collections.OrderedDict()  # uid -> monotonic time last seen, least recently seen first.
+    try:
+        while True:
+            async with reader_lock:
+                try:
+                    arm_tag_irq(rdr, clear_irq)
+                    try:
+                        await asyncio.wait_for(tag_irq.wait(), IRQ_REARM_INTERVAL)
+                    except asyncio.TimeoutError:
+                        # No tag answered; re-arm and send another REQA.
+                        continue
+                    tag_irq.clear()
+                    rdr.init()
+                except Exception as e:
+                    # A transient SPI error; back off below and re-arm on the next pass.
+                    log.error("RFID reader error: %s", e)
+                    raw_uid = None
+                else:
+                    try:
+                        # Wrap the polling operation with our retry mechanism.
+                        raw_uid = await perform_rfid_operation(poll_for_tag, rdr)
+                    except Exception as e:
+                        # perform_rfid_operation has already logged the failure.
+                        log.debug("RFID polling error: %s", e)
+                        raw_uid = None
+            if raw_uid is not None:
+                try:
+                    uid_key = format_uid(raw_uid)
+                    # Forget UIDs last seen more than DUPLICATE_SCAN_TTL ago, then skip repeats.
+                    now = time.monotonic()
+                    while recent and next(iter(recent.values())) <= now - DUPLICATE_SCAN_TTL:
+                        recent.popitem(last=False)
+                    if uid_key in recent:
+                        # Still on the reader: refresh, so it only fires again once it has
+                        # been away for DUPLICATE_SCAN_TTL.
+                        recent.move_to_end(uid_key)
+                        recent[uid_key] = now
+                    else:
+                        log.info("New tag detected with UID: %s", uid_key)
+                        recent[uid_key] = now
+                        await MODE_HANDLERS[current_mode](uid_key, raw_uid, backend, enroll_queue, awaiting)
+                except Exception as e:
+                    log.error("Error while processing tag: %s", e)
+            # Debounce so a tag left on the reader doesn't retrigger the IRQ immediately.
+            await asyncio.sleep(0.2)
+    except asyncio.CancelledError:
+        log.info("RFID scanning task canceled.")
+        raise
+    except Exception as e:
+        log.critical("RFID scanning task encountered a fatal error: %s", e)
+    finally:
+        detach_irq()
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+
+
+# --------------------------------------------------
+# 5. Console Input and Command Listener for Mode Switching
+# --------------------------------------------------
+class ConsoleInput:
+    """
+    Reads stdin on one long-lived daemon thread and hands lines to coroutines.
+    Urgent readers (enrollment labels) are served before regular ones (commands),
+    so a typed label never ends up in the command listener.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._lines = collections.deque()    # Lines typed before anyone asked.
+        self._waiters = collections.deque()  # Futures waiting for the next line.
+        self._closed = False
+
+    def start(self):
+        threading.Thread(target=self._stdin_loop, name="stdin-reader", daemon=True).start()
+
+    def _stdin_loop(self):
+        try:
+            for line in sys.stdin:
+                self._loop.call_soon_threadsafe(self._deliver, line.rstrip("\n"))
+            self._loop.call_soon_threadsafe(self._close)
+        except RuntimeError:
+            # Event loop already closed during shutdown.
+            pass
+
+    def _deliver(self, line):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(line)
+                return
+        self._lines.append(line)
+
+    def _close(self):
+        self._closed = True
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(EOFError())
+
+    async def readline(self, prompt, urgent=False):
+        """
+        Async replacement for input(). Raises EOFError once stdin is closed.
+        """
+        if self._lines:
+            return self._lines.popleft()
+        if self._closed:
+            raise EOFError()
+        print(prompt, end="", flush=True)
+        waiter = self._loop.create_future()
+        if urgent:
+            self._waiters.appendleft(waiter)
+        else:
+            self._waiters.append(waiter)
+        return await waiter
+
+
+async def command_listener(console):
+    """
+    Listens asynchronously for user commands to switch the system mode.
+    Supported commands:
+      • "enrollmode" – switch to enrollment (write) mode.
+      • "admode" – switch to allow/deny (read) mode.
+    """
+    global current_mode
+    log.info("Starting command listener task.")
+    try:
+        while True:
+            cmd = await console.readline("Command ('enrollmode' or 'admode'): ")
+            cmd = cmd.strip().lower()
+            if cmd == "enrollmode":
+                current_mode = Mode.WRITE
+                log.info("Switched to enroll (write) mode.")
+            elif cmd == "admode":
+                current_mode = Mode.READ
+                log.info("Switched to allow/deny (read) mode.")
+            else:
+                log.warning("Unknown command entered: %s", cmd)
+            await asyncio.sleep(0.1)
+    except asyncio.CancelledError:
+        log.info("Command listener task canceled.")
+        raise
+    except Exception as e:
+        log.error("Command listener encountered error: %s", e)
@@ -1,8 +1,8 @@
-from pirc522 import RFID
+from RFIDReader import RFIDContext
 import signal
 import time
 
-rdr = RFID()
+rdr = RFIDContext.get()
 util = rdr.util()
 # Set util debug to true - it will print what's going on
 util.debug = True
@@ -1,6 +1,6 @@
-from pirc522 import RFID
+from RFIDReader import RFIDContext
 
-rdr = RFID()
+rdr = RFIDContext.get()
 rdr.wait_for_tag()
 (error, tag_type) = rdr.request()
 if not error:
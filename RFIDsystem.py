@@ -1,241 +1,305 @@
 import asyncio
+import contextlib
 import sqlite3
 import logging
-import time
-from pirc522 import RFID
+from RFIDScanner import ConsoleInput, command_listener, scan_rfid, setup_logging
 
 # --------------------------------------------------
 # 1. Logging Configuration
 # --------------------------------------------------
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler("rfid_system.log"),
-        logging.StreamHandler()
-    ]
-)
+setup_logging("rfid_system.log")
+log = logging.getLogger(__name__)
+
+DB_PATH = 'rfid_tags.db'
+# Number of read-only connections kept open for cache-miss lookups.
+READ_POOL_SIZE = 2
+# Enrollments are committed in one transaction once this many are pending,
+# or ENROLL_FLUSH_INTERVAL seconds after the first one, whichever comes first.
+ENROLL_FLUSH_EVERY = 10
+ENROLL_FLUSH_INTERVAL = 2.0
 
-# Global mode variable: "read" for access checking; "write" for enrolling new tags.
-current_mode = "read"
+# Statements reused on every call are kept as single constants so the
+# connection's prepared-statement cache always hits.
+_SQL_LOOKUP = "SELECT label FROM rfid_tags WHERE uid = ?"
+_SQL_INSERT = "INSERT INTO rfid_tags (uid, label) VALUES (?, ?)"
 
 
 # --------------------------------------------------
 # 2. Database Initialization with Error Handling
 # --------------------------------------------------
+def connect_db():
+    """
+    Opens a write connection in autocommit mode; enrollment batches manage their
+    own transactions. WAL + synchronous=NORMAL avoids an fsync per commit on the
+    SD card; busy_timeout lets other connections wait for a lock instead of failing.
+    check_same_thread=False lets the writer task run its batches in a worker thread.
+    """
+    connection = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False,
+                                 cached_statements=256)
+    cursor = connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-2000")
+    return connection
+
+
 def init_db():
+    """
+    Creates the schema and returns the tag cache (uid -> label).
+    The cache is loaded over a read-only connection so registered tags are served from memory.
+    """
     try:
-        connection = sqlite3.connect('rfid_tags.db')
-        cursor = connection.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS rfid_tags (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                uid TEXT UNIQUE,
-                label TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        connection.commit()
-        logging.info("Database initialized successfully.")
-        return connection, cursor
+        connection = connect_db()
+        try:
+            cursor = connection.cursor()
+            # The UNIQUE constraint on uid gives SQLite an index for every uid lookup;
+            # a separate CREATE INDEX would only duplicate it and slow down inserts.
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS rfid_tags (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    uid TEXT UNIQUE,
+                    label TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            # Tags enrolled before UIDs were stored as hex used a "1-2-3-4-5" decimal form.
+            # Rows that don't parse, or whose hex UID is already enrolled, are left as they
+            # are so a bad row never stops the system from starting.
+            cursor.execute("SELECT uid FROM rfid_tags WHERE uid LIKE '%-%'")
+            legacy = cursor.fetchall()
+            if legacy:
+                migrated = 0
+                cursor.execute("BEGIN IMMEDIATE")
+                try:
+                    for (uid,) in legacy:
+                        try:
+                            hex_uid = bytes(map(int, uid.split('-'))).hex()
+                        except ValueError as ve:
+                            log.warning("Legacy UID %s not migrated (malformed): %s", uid, ve)
+                            continue
+                        cursor.execute("UPDATE OR IGNORE rfid_tags SET uid = ? WHERE uid = ?", (hex_uid, uid))
+                        if cursor.rowcount:
+                            migrated += 1
+                        else:
+                            log.warning("Legacy UID %s not migrated: %s is already enrolled.", uid, hex_uid)
+                    cursor.execute("COMMIT")
+                except Exception:
+                    cursor.execute("ROLLBACK")
+                    raise
+                log.info("Migrated %d legacy UID(s) to hex format.", migrated)
+        finally:
+            connection.close()
+        reader = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+        try:
+            tag_cache = dict(reader.execute("SELECT uid, label FROM rfid_tags").fetchall())
+        finally:
+            reader.close()
+        log.info("Database initialized successfully (%d tags cached).", len(tag_cache))
+        return tag_cache
     except Exception as e:
-        logging.critical("Failed to initialize database: %s", e)
+        log.critical("Failed to initialize database: %s", e)
         raise
 
 
-# --------------------------------------------------
-# 3. Retry Mechanism for RFID Operations
-# --------------------------------------------------
-async def perform_rfid_operation(operation, *args, max_retries=3, base_delay=0.5, **kwargs):
+def flush_enrollments(cursor, batch):
     """
-    Calls a synchronous operation that might fail, retrying with exponential backoff.
+    Inserts a batch of (uid, label) enrollments in a single explicit transaction.
+    If a row conflicts, the batch is retried row by row so only the conflicting
+    rows are dropped. Success is logged per tag once COMMIT has gone through.
+    Runs in a worker thread and never raises; returns {uid: label or None} with
+    the stored label of every dropped tag, for the caller to resync tag_cache.
     """
-    retries = 0
-    while True:
+    resync = {}
+    if not batch:
+        return resync
+    committed = []
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SAVEPOINT enroll_batch")
+        try:
+            cursor.executemany(_SQL_INSERT, batch)
+            committed = list(batch)
+        except sqlite3.IntegrityError:
+            # executemany keeps the rows before the failing one; undo them and go
+            # row by row. A single failing INSERT only rolls back itself.
+            cursor.execute("ROLLBACK TO enroll_batch")
+            for uid, label in batch:
+                try:
+                    cursor.execute(_SQL_INSERT, (uid, label))
+                    committed.append((uid, label))
+                except sqlite3.IntegrityError as ie:
+                    log.warning("Enrollment of UID %s dropped (IntegrityError): %s", uid, ie)
+        cursor.execute("RELEASE enroll_batch")
+        cursor.execute("COMMIT")
+    except Exception as db_e:
+        log.error("Database error during enrollment: %s", db_e)
+        committed = []
+        try:
+            if cursor.connection.in_transaction:
+                cursor.execute("ROLLBACK")
+        except Exception as rb_e:
+            log.error("Database error during rollback: %s", rb_e)
+    for uid, label in committed:
+        log.info("New tag enrolled successfully with label: %s", label)
+    for uid, _ in set(batch) - set(committed):
         try:
-            result = operation(*args, **kwargs)
-            return result
-        except Exception as ex:
-            retries += 1
-            if retries > max_retries:
-                logging.error("Operation %s failed after %d retries: %s", operation.__name__, max_retries, ex)
-                raise
-            else:
-                delay = base_delay * (2 ** (retries - 1))
-                logging.warning("Operation %s failed with error: %s. Retrying in %.2f sec (attempt %d of %d)",
-                                operation.__name__, ex, delay, retries, max_retries)
-                await asyncio.sleep(delay)
+            cursor.execute(_SQL_LOOKUP, (uid,))
+            record = cursor.fetchone()
+            resync[uid] = record[0] if record else None
+        except Exception as db_e:
+            # Unknown state: drop it from the cache so the next lookup asks the database.
+            log.error("Database error while resyncing UID %s: %s", uid, db_e)
+            resync[uid] = None
+    return resync
 
 
-# --------------------------------------------------
-# 4. RFID Polling, Using Nonblocking Asyncio and Retry
-# --------------------------------------------------
-def poll_for_tag(rdr):
+def apply_resync(tag_cache, resync):
+    """Applies a flush_enrollments() result to tag_cache on the event-loop thread."""
+    for uid, label in resync.items():
+        if label is None:
+            tag_cache.pop(uid, None)
+        else:
+            tag_cache[uid] = label
+
+
+class SQLitePool:
     """
-    Polls for a tag using low-level RFID library calls.
-    If an error code is returned instead of a tag, an Exception is raised.
+    Fixed-size pool of read-only connections, so lookups never queue behind the
+    writer. Connections are opened with check_same_thread=False so queries can run
+    in worker threads, and with query_only so a reader can never write by mistake.
     """
-    error, tag_type = rdr.request()
-    if error:
-        raise Exception(f"RFID request error: {error}")
-    error_uid, raw_uid = rdr.anticoll()
-    if error_uid:
-        raise Exception(f"RFID anticoll error: {error_uid}")
-    return raw_uid
+
+    def __init__(self, path, size=READ_POOL_SIZE):
+        self._all = []
+        self._idle = asyncio.Queue()
+        for _ in range(size):
+            conn = sqlite3.connect(path, check_same_thread=False, cached_statements=256)
+            conn.execute("PRAGMA query_only=1")
+            self._all.append(conn)
+            self._idle.put_nowait(conn)
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        conn = await self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put_nowait(conn)
+
+    def close(self):
+        for conn in self._all:
+            conn.close()
 
 
-async def scan_rfid(cursor, connection):
+class SqliteBackend:
     """
-    Continuously polls for RFID tags without blocking the event loop.
-    Processes each unique tag based on the current operational mode.
-    Wrapped operations are retried if transient errors occur.
+    RFIDScanner backend over the tag cache, the read pool and the writer queue.
+    Lookups are served from tag_cache (uid -> label); cache misses fall back to the
+    database so tags enrolled by another process are picked up. Inserts update the
+    cache immediately and are committed by db_writer_task with the next batch.
     """
-    rdr = RFID()
-    logging.info("Starting RFID scanning task.")
-    last_uid = None
-    try:
-        while True:
-            try:
-                # Wrap the polling operation with our retry mechanism.
-                raw_uid = await perform_rfid_operation(poll_for_tag, rdr)
-                uid_str = '-'.join(map(str, raw_uid))
-                # Only process the tag once until it’s removed.
-                if uid_str != last_uid:
-                    logging.info("New tag detected with UID: %s", uid_str)
-                    last_uid = uid_str
-                    if current_mode == "read":
-                        # Allow/Deny Mode: Query database to check registration.
-                        try:
-                            cursor.execute("SELECT * FROM rfid_tags WHERE uid = ?", (uid_str,))
-                            record = cursor.fetchone()
-                            if record:
-                                logging.info("Access Allowed! Registered label: %s", record[2])
-                            else:
-                                logging.info("Access Denied! Tag not found in the database.")
-                        except Exception as db_ex:
-                            logging.error("Database error during access check: %s", db_ex)
-                    elif current_mode == "write":
-                        # Enroll Mode: Register a new tag if not already enrolled.
-                        try:
-                            cursor.execute("SELECT * FROM rfid_tags WHERE uid = ?", (uid_str,))
-                            record = cursor.fetchone()
-                            if record:
-                                logging.info("Tag already registered. Enrollment denied.")
-                            else:
-                                # Use run_in_executor to make the blocking input() nonblocking.
-                                loop = asyncio.get_event_loop()
-                                label = await loop.run_in_executor(None, input, "Enter a label for the new tag: ")
-                                label = label.strip()
-                                if not label:
-                                    logging.warning("Empty label input. Skipping enrollment for UID: %s", uid_str)
-                                    continue
-
-                                # Prepare data: write "Registered" to block 8.
-                                data_text = "Registered"
-                                data_bytes = [ord(c) for c in data_text]
-                                # Ensure exactly 16 bytes (trim or pad)
-                                data_bytes = data_bytes[:16] + [0] * (16 - len(data_bytes))
-
-                                # Perform the authentication and writing with retries.
-                                await perform_rfid_operation(rdr.auth, rdr.AUTHENT1A, 8, [0xFF] * 6, raw_uid)
-                                await perform_rfid_operation(rdr.write, 8, data_bytes)
-                                # Stop encryption; wrap in try/except since it’s final.
-                                try:
-                                    rdr.stop_crypto()
-                                except Exception as ex:
-                                    logging.warning("Error during stop_crypto: %s", ex)
-                                logging.info("Data written to tag (block 8).")
-
-                                # Insert new tag registration into the database.
-                                try:
-                                    cursor.execute("INSERT INTO rfid_tags (uid, label) VALUES (?, ?)", (uid_str, label))
-                                    connection.commit()
-                                    logging.info("New tag enrolled successfully with label: %s", label)
-                                except sqlite3.IntegrityError as ie:
-                                    logging.warning("Tag insertion failed (IntegrityError): %s", ie)
-                                except Exception as db_e:
-                                    logging.error("Database error during enrollment: %s", db_e)
-                        except Exception as enroll_ex:
-                            logging.error("Error in enrollment process: %s", enroll_ex)
-            except Exception as e:
-                logging.error("RFID polling error: %s", e)
-            # Reset last_uid when no tag is detected for a new event.
-            await asyncio.sleep(0.2)
-    except asyncio.CancelledError:
-        logging.info("RFID scanning task canceled.")
-        raise
-    except Exception as e:
-        logging.critical("RFID scanning task encountered a fatal error: %s", e)
-    finally:
-        try:
-            rdr.cleanup()
-            logging.info("RFID reader cleanup completed.")
-        except Exception as cleanup_err:
-            logging.error("Error during RFID cleanup: %s", cleanup_err)
 
+    def __init__(self, tag_cache, pool, db_queue):
+        self.tag_cache = tag_cache
+        self.pool = pool
+        self.db_queue = db_queue
 
-# --------------------------------------------------
-# 5. Asynchronous Command Listener for Mode Switching
-# --------------------------------------------------
-async def command_listener():
+    async def lookup(self, uid):
+        label = self.tag_cache.get(uid)
+        if label is None:
+            async with self.pool.acquire() as conn:
+                record = await asyncio.to_thread(lambda: conn.execute(_SQL_LOOKUP, (uid,)).fetchone())
+            if record:
+                label = self.tag_cache[uid] = record[0]
+        return label
+
+    async def insert(self, uid, label):
+        self.tag_cache[uid] = label
+        await self.db_queue.put(("insert", uid, label))
+
+
+async def db_writer_task(db_queue, tag_cache):
     """
-    Listens asynchronously for user commands to switch the system mode.
-    Supported commands:
-      • "enrollmode" – switch to enrollment (write) mode.
-      • "admode" – switch to allow/deny (read) mode.
+    Sole owner of the write connection. Consumes ("insert", uid, label) commands
+    from db_queue and commits them in batches: once ENROLL_FLUSH_EVERY are queued,
+    or ENROLL_FLUSH_INTERVAL seconds after the first one, whichever comes first.
+    Batches run in a worker thread so commits never stall the scan loop.
     """
-    global current_mode
-    loop = asyncio.get_event_loop()
-    logging.info("Starting command listener task.")
+    loop = asyncio.get_running_loop()
+    connection = connect_db()
+    cursor = connection.cursor()
+    batch = []
+    flush = None
+    log.info("Starting database writer task.")
     try:
         while True:
-            cmd = await loop.run_in_executor(None, input, "Command ('enrollmode' or 'admode'): ")
-            cmd = cmd.strip().lower()
-            if cmd == "enrollmode":
-                current_mode = "write"
-                logging.info("Switched to enroll (write) mode.")
-            elif cmd == "admode":
-                current_mode = "read"
-                logging.info("Switched to allow/deny (read) mode.")
-            else:
-                logging.warning("Unknown command entered: %s", cmd)
-            await asyncio.sleep(0.1)
+            _, uid, label = await db_queue.get()
+            batch.append((uid, label))
+            deadline = loop.time() + ENROLL_FLUSH_INTERVAL
+            while len(batch) < ENROLL_FLUSH_EVERY:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    _, uid, label = await asyncio.wait_for(db_queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append((uid, label))
+            # Shielded so a cancellation cannot abandon the thread mid-transaction.
+            flush = asyncio.ensure_future(asyncio.to_thread(flush_enrollments, cursor, batch))
+            batch = []
+            apply_resync(tag_cache, await asyncio.shield(flush))
     except asyncio.CancelledError:
-        logging.info("Command listener task canceled.")
+        log.info("Database writer task canceled.")
         raise
-    except Exception as e:
-        logging.error("Command listener encountered error: %s", e)
+    finally:
+        # Let a batch interrupted by cancellation finish before reusing the connection.
+        if flush is not None:
+            await asyncio.wait([flush])
+        # Commit whatever was still queued at shutdown.
+        while not db_queue.empty():
+            _, uid, label = db_queue.get_nowait()
+            batch.append((uid, label))
+        flush_enrollments(cursor, batch)
+        connection.close()
+        log.info("Database connection closed.")
 
 
 # --------------------------------------------------
-# 6. Main Application With Task Management and Cancellation
+# 3. Main Application With Task Management and Cancellation
 # --------------------------------------------------
 async def main():
-    connection, cursor = init_db()
+    tag_cache = init_db()
+    db_queue = asyncio.Queue()
+    pool = SQLitePool(DB_PATH)
+    console = ConsoleInput(asyncio.get_running_loop())
+    console.start()
     tasks = [
-        asyncio.create_task(scan_rfid(cursor, connection)),
-        asyncio.create_task(command_listener())
+        asyncio.create_task(db_writer_task(db_queue, tag_cache)),
+        asyncio.create_task(scan_rfid(console, SqliteBackend(tag_cache, pool, db_queue))),
+        asyncio.create_task(command_listener(console))
     ]
     try:
         # Gather tasks and wait indefinitely (they run until cancellation).
         await asyncio.gather(*tasks)
     except Exception as e:
-        logging.critical("Main tasks encountered an error: %s", e)
+        log.critical("Main tasks encountered an error: %s", e)
     finally:
-        # Cancel all tasks on exit and close the database connection.
+        # Cancel all tasks on exit; the writer commits anything still queued.
         for task in tasks:
             task.cancel()
         await asyncio.gather(*tasks, return_exceptions=True)
-        connection.close()
-        logging.info("Database connection closed.")
+        pool.close()
 
 # --------------------------------------------------
-# 7. Top-Level Exception Handling and Program Shutdown
+# 4. Top-Level Exception Handling and Program Shutdown
 # --------------------------------------------------
 if __name__ == "__main__":
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
-        logging.info("Program terminated by user (KeyboardInterrupt).")
+        log.info("Program terminated by user (KeyboardInterrupt).")
     except Exception as e:
-        logging.critical("Unhandled exception in main: %s", e)
+        log.critical("Unhandled exception in main: %s", e)